@@ -1,10 +1,23 @@
 """Flask application for Agnar's Cellar."""
 
+import io
 import os
+import re
+import threading
 import uuid
-import base64
 from pathlib import Path
 from flask import Flask, request, jsonify, render_template, send_from_directory
+from flask.json.provider import DefaultJSONProvider
+
+try:
+    import pybase64 as base64  # SIMD-accelerated, drop-in for the stdlib module
+except ImportError:
+    import base64
+
+try:
+    import orjson
+except ImportError:
+    orjson = None
 
 import database
 from wine_analyzer import analyze_wine_image, identify_wine_image, validate_wine_data, analyze_with_clarification, get_wine_pairing
@@ -16,48 +29,73 @@ USE_CLOUDINARY = CLOUDINARY_URL is not None
 if USE_CLOUDINARY:
     import cloudinary
     import cloudinary.uploader
+    import cloudinary.utils
     cloudinary.config(cloudinary_url=CLOUDINARY_URL)
+    # The SDK's default pool keeps a single connection per host; widen it so
+    # concurrent uploads/deletes reuse warm TLS connections to the API.
+    cloudinary.uploader._http = cloudinary.utils.get_http_connector(
+        cloudinary.config(),
+        dict(cloudinary.CERT_KWARGS, maxsize=10, retries=3)
+    )
+
+
+class ORJSONProvider(DefaultJSONProvider):
+    """JSON provider backed by orjson, matching Flask's default output."""
+
+    def dumps(self, obj, **kwargs):
+        return orjson.dumps(
+            obj,
+            default=self.default,
+            option=orjson.OPT_SORT_KEYS | orjson.OPT_PASSTHROUGH_DATETIME
+        ).decode("utf-8")
+
+    def loads(self, s, **kwargs):
+        return orjson.loads(s)
+
 
 app = Flask(__name__)
+if orjson is not None:
+    app.json = ORJSONProvider(app)
 app.config["MAX_CONTENT_LENGTH"] = 16 * 1024 * 1024  # 16MB max upload
 
 UPLOAD_FOLDER = Path(__file__).parent / "static" / "uploads"
+UPLOAD_CACHE_MAX_AGE = 365 * 24 * 60 * 60  # one year
 ALLOWED_EXTENSIONS = {"png", "jpg", "jpeg", "gif", "webp"}
+MEDIA_TYPES = {
+    "jpg": "image/jpeg",
+    "jpeg": "image/jpeg",
+    "png": "image/png",
+    "gif": "image/gif",
+    "webp": "image/webp"
+}
+_ALLOWED_FILE_RE = re.compile(
+    r"\.(" + "|".join(sorted(ALLOWED_EXTENSIONS)) + r")\Z", re.IGNORECASE
+)
+
+# Per-thread scratch buffer for reading uploads, reused across requests and
+# grown to the largest upload the thread has seen
+_upload_buffer = threading.local()
 
 
 def allowed_file(filename):
-    """Check if file extension is allowed."""
-    return "." in filename and filename.rsplit(".", 1)[1].lower() in ALLOWED_EXTENSIONS
+    """Check if file extension is allowed. Returns the lowercased extension or None."""
+    match = _ALLOWED_FILE_RE.search(filename)
+    return match.group(1).lower() if match else None
 
 
-def save_uploaded_file(file_content, filename):
-    """Save uploaded file and return path/URL."""
+def save_uploaded_file(file_content, filename, ext):
+    """Save uploaded file and return path/URL. ext comes from allowed_file()."""
     if not file_content or not filename:
         return None, None
 
-    if not allowed_file(filename):
-        return None, None
-
-    # Determine media type
-    ext = filename.rsplit(".", 1)[1].lower() if "." in filename else "jpg"
-    media_types = {
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "gif": "image/gif",
-        "webp": "image/webp"
-    }
-    media_type = media_types.get(ext, "image/jpeg")
-
     if USE_CLOUDINARY:
-        # Upload to Cloudinary using base64 data URI
+        # Upload raw bytes to Cloudinary as multipart (no base64 data URI)
         try:
-            b64_data = base64.standard_b64encode(file_content).decode("utf-8")
-            data_uri = f"data:{media_type};base64,{b64_data}"
             result = cloudinary.uploader.upload(
-                data_uri,
+                io.BytesIO(file_content),
                 folder="wine-collection",
-                resource_type="image"
+                resource_type="image",
+                filename=filename
             )
             # Return (cloudinary_url, public_id)
             return result["secure_url"], result["public_id"]
@@ -73,30 +111,51 @@ def save_uploaded_file(file_content, filename):
         return f"uploads/{new_filename}", None
 
 
-def get_image_for_analysis(file):
-    """Get image data for AI analysis. Returns (base64_data, media_type, file_content, filename)."""
+def _read_upload(stream):
+    """Read an upload stream into a per-thread buffer and return a memoryview of it.
+
+    The view is only valid until the same thread reads its next upload.
+    """
+    try:
+        readinto = stream.readinto
+        size = stream.seek(0, io.SEEK_END)
+        stream.seek(0)
+    except (AttributeError, OSError):
+        # SpooledTemporaryFile, which Werkzeug spools uploads to, only has
+        # readinto() from Python 3.11
+        return memoryview(stream.read())
+
+    buf = getattr(_upload_buffer, "buf", None)
+    if buf is None or len(buf) < size:
+        buf = _upload_buffer.buf = bytearray(size)
+    view = memoryview(buf)
+    filled = 0
+    while filled < size:
+        read = readinto(view[filled:size])
+        if not read:
+            break
+        filled += read
+    return view[:filled]
+
+
+def get_image_for_analysis(file, ext):
+    """
+    Get image data for AI analysis. Returns (file_content, media_type, filename).
+    ext is the extension allowed_file() returned for the upload.
+    """
     if not file:
-        return None, None, None, None
+        return None, None, None
 
-    # Read file content
-    content = file.read()
+    # Read file content into this thread's reusable buffer
+    content = _read_upload(file.stream)
 
-    # Determine media type
     filename = file.filename if file.filename else "image.jpg"
-    ext = filename.rsplit(".", 1)[1].lower() if "." in filename else "jpg"
-    media_types = {
-        "jpg": "image/jpeg",
-        "jpeg": "image/jpeg",
-        "png": "image/png",
-        "gif": "image/gif",
-        "webp": "image/webp"
-    }
-    media_type = media_types.get(ext, "image/jpeg")
+    return content, MEDIA_TYPES[ext], filename
 
-    # Encode to base64
-    b64_data = base64.standard_b64encode(content).decode("utf-8")
 
-    return b64_data, media_type, content, filename
+def encode_image(file_content):
+    """Base64-encode image bytes for inline submission to Claude."""
+    return base64.standard_b64encode(file_content).decode("utf-8")
 
 
 def delete_cloudinary_image(public_id):
@@ -120,7 +179,10 @@ def index():
 @app.route("/static/uploads/<path:filename>")
 def serve_upload(filename):
     """Serve uploaded files (only used when not using Cloudinary)."""
-    return send_from_directory(UPLOAD_FOLDER, filename)
+    # Uploads get UUID filenames and are never rewritten, so cache them for good
+    response = send_from_directory(UPLOAD_FOLDER, filename, conditional=True, max_age=UPLOAD_CACHE_MAX_AGE)
+    response.headers["Cache-Control"] = f"public, max-age={UPLOAD_CACHE_MAX_AGE}, immutable"
+    return response
 
 
 # API Endpoints
@@ -143,8 +205,8 @@ def get_wines():
     # Remove None values
     filters = {k: v for k, v in filters.items() if v is not None and v != ""}
 
-    wines = database.get_all_wines(filters if filters else None)
-    return jsonify(wines)
+    wines_json = database.get_all_wines_json(filters if filters else None)
+    return app.response_class(wines_json, mimetype="application/json")
 
 
 @app.route("/api/wines", methods=["POST"])
@@ -223,22 +285,32 @@ def analyze_image():
     if file.filename == "":
         return jsonify({"error": "No file selected"}), 400
 
-    if not allowed_file(file.filename):
+    ext = allowed_file(file.filename)
+    if not ext:
         return jsonify({"error": "Invalid file type. Allowed: png, jpg, jpeg, gif, webp"}), 400
 
     # Get image data for analysis
-    b64_data, media_type, file_content, filename = get_image_for_analysis(file)
-    if not b64_data:
+    file_content, media_type, filename = get_image_for_analysis(file, ext)
+    if not file_content:
         return jsonify({"error": "Failed to process image"}), 500
 
+    image_url, cloudinary_id = None, None
+    if USE_CLOUDINARY:
+        # Upload first so Claude can fetch the image by URL instead of base64
+        image_url, cloudinary_id = save_uploaded_file(file_content, filename, ext)
+
     # Analyze with Claude
-    result = analyze_wine_image(image_base64=b64_data, media_type=media_type)
+    if image_url:
+        result = analyze_wine_image(image_url=image_url)
+    else:
+        result = analyze_wine_image(image_base64=encode_image(file_content), media_type=media_type)
 
     # Validate and clean the data
     cleaned = validate_wine_data(result)
 
-    # Save the file (after analysis succeeds)
-    image_url, cloudinary_id = save_uploaded_file(file_content, filename)
+    # Save the file locally (after analysis succeeds)
+    if not USE_CLOUDINARY:
+        image_url, cloudinary_id = save_uploaded_file(file_content, filename, ext)
 
     if image_url:
         cleaned["image_path"] = image_url
@@ -312,48 +384,48 @@ def drink_wine():
     if file.filename == "":
         return jsonify({"error": "No file selected"}), 400
 
-    if not allowed_file(file.filename):
+    ext = allowed_file(file.filename)
+    if not ext:
         return jsonify({"error": "Invalid file type. Allowed: png, jpg, jpeg, gif, webp"}), 400
 
     # Get image data for analysis (don't save, just analyze)
-    b64_data, media_type, _, _ = get_image_for_analysis(file)
-    if not b64_data:
+    file_content, media_type, _ = get_image_for_analysis(file, ext)
+    if not file_content:
         return jsonify({"error": "Failed to process image"}), 500
 
     # Identify the wine
-    result = identify_wine_image(image_base64=b64_data, media_type=media_type)
+    result = identify_wine_image(image_base64=encode_image(file_content), media_type=media_type)
 
     if result.get("error"):
         return jsonify(result), 400
 
     # Find matching wine in database
-    existing = database.find_matching_wine(
+    wine_id = database.find_matching_wine_id(
         name=result.get("name"),
         producer=result.get("producer"),
         vintage=result.get("vintage")
     )
 
-    if not existing:
+    if wine_id is None:
         return jsonify({
             "error": "Wine not found in collection",
             "identified": result
         }), 404
 
-    # Check if there's any quantity left
-    if existing.get("quantity", 0) <= 0:
+    # Reduce quantity by 1, unless there are no bottles left
+    drank = database.drink_bottle(wine_id)
+    updated_wine = database.get_wine(wine_id)
+
+    if not drank:
         return jsonify({
             "error": "No bottles left of this wine",
-            "wine": existing
+            "wine": updated_wine
         }), 400
 
-    # Reduce quantity by 1
-    database.increment_wine_quantity(existing["id"], -1)
-    updated_wine = database.get_wine(existing["id"])
-
     return jsonify({
-        "message": f"Enjoyed a bottle of {existing['name']}!",
+        "message": f"Enjoyed a bottle of {updated_wine['name']}!",
         "wine": updated_wine,
-        "previous_quantity": existing["quantity"],
+        "previous_quantity": updated_wine["quantity"] + 1,
         "new_quantity": updated_wine["quantity"]
     })
 
@@ -362,7 +434,9 @@ def drink_wine():
 def get_stats():
     """Get collection statistics."""
     stats = database.get_stats()
-    return jsonify(stats)
+    response = jsonify(stats)
+    response.add_etag()
+    return response.make_conditional(request)
 
 
 @app.route("/api/pair", methods=["POST"])
@@ -376,8 +450,8 @@ def pair_wine():
     if not food_description:
         return jsonify({"error": "Please describe what you're eating"}), 400
 
-    # Get all wines from the collection
-    wines = database.get_all_wines()
+    # Stream wines from the collection
+    wines = database.iter_wines()
 
     # Get pairing suggestions
     suggestions = get_wine_pairing(wines, food_description)
@@ -3,133 +3,393 @@
 import os
 import sqlite3
 import json
+import threading
+import time
+import functools
+from contextlib import contextmanager
 from datetime import datetime
 from pathlib import Path
+
+try:
+    import orjson  # faster C encoder/parser for the JSON columns
+
+    json_loads = orjson.loads
+
+    def json_dumps(value):
+        return orjson.dumps(value).decode("utf-8")
+except ImportError:
+    json_loads = json.loads
+    json_dumps = json.dumps
+
 # Check for PostgreSQL connection
 DATABASE_URL = os.environ.get("DATABASE_URL")
 USE_POSTGRES = DATABASE_URL is not None
 
 if USE_POSTGRES:
-    import psycopg2
-    from psycopg2.extras import RealDictCursor
+    from psycopg2.extras import Json, RealDictCursor, execute_values
+    from psycopg2.extensions import connection as PGConnection
+    from psycopg2.pool import ThreadedConnectionPool
+
+    class PreparingConnection(PGConnection):
+        """PostgreSQL connection that tracks its server-side prepared statements."""
+
+        def __init__(self, *args, **kwargs):
+            super().__init__(*args, **kwargs)
+            self.prepared = set()
 
 # SQLite fallback path
 SQLITE_PATH = Path(__file__).parent / "wines.db"
 
 
+# Applied once to each new SQLite connection
+SQLITE_PRAGMAS = (
+    "PRAGMA journal_mode=WAL",
+    "PRAGMA synchronous=NORMAL",
+    "PRAGMA temp_store=MEMORY",
+    "PRAGMA mmap_size=268435456",  # 256MB
+    "PRAGMA cache_size=-65536",  # 64MB
+)
+
+# Compiled statements each SQLite connection keeps for reuse
+SQLITE_STATEMENT_CACHE_SIZE = 256
+
+# Bumped on every write so cached reads (get_stats) can be invalidated.
+# The TTL bounds staleness when several worker processes share a database.
+_data_version = 0
+STATS_CACHE_TTL = 60  # seconds
+
+# (year, epoch time the next local year starts) for current_year()
+_year_cache = (None, 0.0)
+
+# PostgreSQL connections come from a pool created on first use (per process)
+POOL_MIN_CONNECTIONS = 2
+POOL_MAX_CONNECTIONS = 20
+_pool = None
+_pool_lock = threading.Lock()
+
+# SQLite connections are reused per thread instead of reopened per call.
+# While transaction() is open, _local.transaction_conn holds its connection
+# and _local.transaction_depth counts nested blocks.
+_local = threading.local()
+
+
+# Column order of the wines table, used when the database builds JSON itself
+WINE_COLUMNS = (
+    "id", "name", "producer", "vintage", "country", "region", "appellation",
+    "style", "grape_varieties", "alcohol_percentage", "quantity",
+    "drinking_window_start", "drinking_window_end", "score", "description",
+    "tasting_notes", "image_path", "cloudinary_id", "price", "price_currency",
+    "created_at", "updated_at"
+)
+# JSON columns (JSONB on PostgreSQL, TEXT on SQLite) and the value used when
+# one is empty or invalid
+JSON_COLUMNS = {"grape_varieties": "[]", "tasting_notes": "{}"}
+# Columns create_wine() writes, in wine_insert_params() order
+INSERT_FIELDS = (
+    "name", "producer", "vintage", "country", "region", "appellation",
+    "style", "grape_varieties", "alcohol_percentage", "quantity",
+    "drinking_window_start", "drinking_window_end", "score",
+    "description", "tasting_notes", "image_path", "cloudinary_id",
+    "price", "price_currency"
+)
+# Rows fetched per round trip by server-side cursors on PostgreSQL
+STREAM_BATCH_SIZE = 1000
+# Rows per multi-row INSERT statement in create_wines() on PostgreSQL
+BULK_INSERT_PAGE_SIZE = 500
+# Columns build_wines_query() will ORDER BY
+VALID_SORT_FIELDS = frozenset({
+    "name", "vintage", "score", "quantity", "drinking_window_start", "created_at"
+})
+# Columns update_wine() accepts, in the order they appear in the SET clause
+UPDATABLE_FIELDS = (
+    "name", "producer", "vintage", "country", "region", "appellation",
+    "style", "alcohol_percentage", "quantity", "drinking_window_start",
+    "drinking_window_end", "score", "description", "image_path", "cloudinary_id",
+    "price", "price_currency", "grape_varieties", "tasting_notes"
+)
+
+
 def get_connection():
-    """Get a database connection."""
-    if USE_POSTGRES:
-        # Use DATABASE_URL directly
-        conn = psycopg2.connect(DATABASE_URL)
+    """Get a database connection. Pair every call with release_connection()."""
+    # Inside transaction(), every helper on this thread joins the open transaction
+    conn = getattr(_local, "transaction_conn", None)
+    if conn is not None:
         return conn
+    if USE_POSTGRES:
+        return _get_pool().getconn()
     else:
-        conn = sqlite3.connect(SQLITE_PATH)
-        conn.row_factory = sqlite3.Row
+        conn = getattr(_local, "conn", None)
+        if conn is None:
+            conn = sqlite3.connect(SQLITE_PATH, cached_statements=SQLITE_STATEMENT_CACHE_SIZE)
+            conn.row_factory = sqlite3.Row
+            for pragma in SQLITE_PRAGMAS:
+                conn.execute(pragma)
+            _local.conn = conn
         return conn
 
 
-def get_cursor(conn):
-    """Get a cursor with appropriate row factory."""
+def release_connection(conn):
+    """Release a connection obtained from get_connection()."""
+    if conn is getattr(_local, "transaction_conn", None):
+        # The enclosing transaction() commits or rolls back
+        return
     if USE_POSTGRES:
-        return conn.cursor(cursor_factory=RealDictCursor)
+        # The pool rolls back any transaction left open by a failed call
+        _get_pool().putconn(conn)
+    elif conn.in_transaction:
+        # SQLite connections stay open for reuse by the same thread,
+        # so discard writes left uncommitted by a failed call
+        conn.rollback()
+
+
+def _get_pool():
+    """Get or create the PostgreSQL connection pool."""
+    global _pool
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                _pool = ThreadedConnectionPool(
+                    POOL_MIN_CONNECTIONS, POOL_MAX_CONNECTIONS,
+                    dsn=DATABASE_URL, connection_factory=PreparingConnection
+                )
+    return _pool
+
+
+def get_cursor(conn, name=None):
+    """
+    Get a cursor with appropriate row factory.
+    A name makes a server-side cursor on PostgreSQL, fetched in batches.
+    """
+    if USE_POSTGRES:
+        cursor = conn.cursor(name=name, cursor_factory=RealDictCursor)
+        if name:
+            cursor.itersize = STREAM_BATCH_SIZE
+        return cursor
     else:
+        # SQLite cursors already step through results lazily
         return conn.cursor()
 
 
+@contextmanager
+def transaction():
+    """
+    Run several writes in one transaction and commit them together.
+
+    Yields a cursor to pass to create_wine, update_wine, delete_wine or
+    increment_wine_quantity; the block commits once on success and rolls
+    back (via release_connection) if it raises. Other helpers called in the
+    block, reads included, use the same connection, and nested blocks join
+    the outermost one instead of committing on their own.
+    """
+    depth = getattr(_local, "transaction_depth", 0)
+    if depth:
+        _local.transaction_depth = depth + 1
+        cursor = get_cursor(_local.transaction_conn)
+        try:
+            yield cursor
+        finally:
+            cursor.close()
+            _local.transaction_depth = depth
+        return
+
+    conn = get_connection()
+    _local.transaction_conn = conn
+    _local.transaction_depth = 1
+    try:
+        cursor = get_cursor(conn)
+        yield cursor
+        conn.commit()
+        cursor.close()
+    finally:
+        _local.transaction_conn = None
+        _local.transaction_depth = 0
+        release_connection(conn)
+        # Also after a rollback, so reads cached mid-block are dropped
+        _bump_data_version()
+
+
+def execute_prepared(cursor, name, query, params):
+    """
+    Execute a fixed, frequently used query by name.
+
+    On PostgreSQL the query is PREPAREd once per pooled connection and then
+    run with EXECUTE, skipping parse/plan. sqlite3 already reuses compiled
+    statements from its per-connection cache, so SQLite executes directly.
+    """
+    if not USE_POSTGRES:
+        cursor.execute(query, params)
+        return
+
+    conn = cursor.connection
+    if name not in conn.prepared:
+        # Server-side PREPARE uses $1, $2, ... instead of %s
+        parts = query.split("%s")
+        numbered = parts[0] + "".join(f"${i}{part}" for i, part in enumerate(parts[1:], 1))
+        cursor.execute(f"PREPARE {name} AS {numbered}")
+        conn.prepared.add(name)
+    cursor.execute(f"EXECUTE {name} ({', '.join(['%s'] * len(params))})", params)
+
+
 def get_placeholder():
     """Get the parameter placeholder for the database."""
     return "%s" if USE_POSTGRES else "?"
 
 
+# Whole PostgreSQL schema, sent as one multi-statement batch
+POSTGRES_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS wines (
+        id SERIAL PRIMARY KEY,
+        name TEXT NOT NULL,
+        producer TEXT,
+        vintage INTEGER,
+        country TEXT,
+        region TEXT,
+        appellation TEXT,
+        style TEXT,
+        grape_varieties JSONB,
+        alcohol_percentage REAL,
+        quantity INTEGER DEFAULT 1,
+        drinking_window_start INTEGER,
+        drinking_window_end INTEGER,
+        score INTEGER,
+        description TEXT,
+        tasting_notes JSONB,
+        image_path TEXT,
+        cloudinary_id TEXT,
+        price DECIMAL(10,2),
+        price_currency TEXT DEFAULT 'USD',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Add columns if they don't exist (for existing tables)
+    ALTER TABLE wines
+        ADD COLUMN IF NOT EXISTS cloudinary_id TEXT,
+        ADD COLUMN IF NOT EXISTS price DECIMAL(10,2),
+        ADD COLUMN IF NOT EXISTS price_currency TEXT DEFAULT 'USD';
+
+    -- Convert JSON fields stored as TEXT by older versions to JSONB
+    DO $$
+    BEGIN
+        IF (SELECT data_type FROM information_schema.columns
+            WHERE table_name = 'wines' AND column_name = 'grape_varieties') = 'text' THEN
+            ALTER TABLE wines
+                ALTER COLUMN grape_varieties TYPE JSONB USING NULLIF(grape_varieties, '')::jsonb,
+                ALTER COLUMN tasting_notes TYPE JSONB USING NULLIF(tasting_notes, '')::jsonb;
+        END IF;
+    END $$;
+
+    -- Indexes for the filter, stats and duplicate-matching queries
+    CREATE INDEX IF NOT EXISTS idx_wines_country ON wines (country);
+    CREATE INDEX IF NOT EXISTS idx_wines_region ON wines (region);
+    CREATE INDEX IF NOT EXISTS idx_wines_style ON wines (style);
+    CREATE INDEX IF NOT EXISTS idx_wines_vintage ON wines (vintage);
+    CREATE INDEX IF NOT EXISTS idx_wines_drinking_window
+        ON wines (drinking_window_start, drinking_window_end);
+    CREATE INDEX IF NOT EXISTS idx_wines_match
+        ON wines (LOWER(name), LOWER(producer), vintage);
+    CREATE INDEX IF NOT EXISTS idx_wines_created_at ON wines (created_at DESC);
+
+    -- Trigram indexes let substring ILIKE searches avoid a full scan.
+    -- Skipped if the role may not create the pg_trgm extension.
+    DO $$
+    BEGIN
+        CREATE EXTENSION IF NOT EXISTS pg_trgm;
+        CREATE INDEX IF NOT EXISTS idx_wines_name_trgm ON wines USING gin (name gin_trgm_ops);
+        CREATE INDEX IF NOT EXISTS idx_wines_producer_trgm ON wines USING gin (producer gin_trgm_ops);
+        -- Every arm of the search's OR needs an index for a BitmapOr plan
+        CREATE INDEX IF NOT EXISTS idx_wines_grapes_trgm
+            ON wines USING gin ((grape_varieties::text) gin_trgm_ops);
+    EXCEPTION
+        WHEN insufficient_privilege OR undefined_file THEN NULL;
+    END $$;
+"""
+
+# Whole SQLite schema, run with executescript()
+SQLITE_SCHEMA = """
+    CREATE TABLE IF NOT EXISTS wines (
+        id INTEGER PRIMARY KEY AUTOINCREMENT,
+        name TEXT NOT NULL,
+        producer TEXT,
+        vintage INTEGER,
+        country TEXT,
+        region TEXT,
+        appellation TEXT,
+        style TEXT,
+        grape_varieties TEXT,
+        alcohol_percentage REAL,
+        quantity INTEGER DEFAULT 1,
+        drinking_window_start INTEGER,
+        drinking_window_end INTEGER,
+        score INTEGER,
+        description TEXT,
+        tasting_notes TEXT,
+        image_path TEXT,
+        cloudinary_id TEXT,
+        price REAL,
+        price_currency TEXT DEFAULT 'USD',
+        created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
+        updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
+    );
+
+    -- Full-text index for search, kept in sync with wines via triggers
+    CREATE VIRTUAL TABLE IF NOT EXISTS wines_fts USING fts5(
+        name, producer, grape_varieties,
+        content='wines', content_rowid='id'
+    );
+    CREATE TRIGGER IF NOT EXISTS wines_fts_insert AFTER INSERT ON wines BEGIN
+        INSERT INTO wines_fts(rowid, name, producer, grape_varieties)
+        VALUES (new.id, new.name, new.producer, new.grape_varieties);
+    END;
+    CREATE TRIGGER IF NOT EXISTS wines_fts_delete AFTER DELETE ON wines BEGIN
+        INSERT INTO wines_fts(wines_fts, rowid, name, producer, grape_varieties)
+        VALUES ('delete', old.id, old.name, old.producer, old.grape_varieties);
+    END;
+    CREATE TRIGGER IF NOT EXISTS wines_fts_update
+    AFTER UPDATE OF name, producer, grape_varieties ON wines BEGIN
+        INSERT INTO wines_fts(wines_fts, rowid, name, producer, grape_varieties)
+        VALUES ('delete', old.id, old.name, old.producer, old.grape_varieties);
+        INSERT INTO wines_fts(rowid, name, producer, grape_varieties)
+        VALUES (new.id, new.name, new.producer, new.grape_varieties);
+    END;
+
+    -- Indexes for the filter, stats and duplicate-matching queries
+    CREATE INDEX IF NOT EXISTS idx_wines_country ON wines (country);
+    CREATE INDEX IF NOT EXISTS idx_wines_region ON wines (region);
+    CREATE INDEX IF NOT EXISTS idx_wines_style ON wines (style);
+    CREATE INDEX IF NOT EXISTS idx_wines_vintage ON wines (vintage);
+    CREATE INDEX IF NOT EXISTS idx_wines_drinking_window
+        ON wines (drinking_window_start, drinking_window_end);
+    -- SQLite matches with COLLATE NOCASE rather than LOWER()
+    CREATE INDEX IF NOT EXISTS idx_wines_match_nocase
+        ON wines (name COLLATE NOCASE, producer COLLATE NOCASE, vintage);
+    CREATE INDEX IF NOT EXISTS idx_wines_created_at ON wines (created_at DESC);
+"""
+
+
 def init_db():
-    """Initialize the database with the wines table."""
+    """
+    Initialize the database with the wines table.
+    Called by the app on startup, or via `python -m database init`.
+    """
     conn = get_connection()
-    cursor = get_cursor(conn)
-
-    if USE_POSTGRES:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS wines (
-                id SERIAL PRIMARY KEY,
-                name TEXT NOT NULL,
-                producer TEXT,
-                vintage INTEGER,
-                country TEXT,
-                region TEXT,
-                appellation TEXT,
-                style TEXT,
-                grape_varieties TEXT,
-                alcohol_percentage REAL,
-                quantity INTEGER DEFAULT 1,
-                drinking_window_start INTEGER,
-                drinking_window_end INTEGER,
-                score INTEGER,
-                description TEXT,
-                tasting_notes TEXT,
-                image_path TEXT,
-                cloudinary_id TEXT,
-                price DECIMAL(10,2),
-                price_currency TEXT DEFAULT 'USD',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
-        # Add columns if they don't exist (for existing tables)
-        cursor.execute("""
-            DO $$
-            BEGIN
-                ALTER TABLE wines ADD COLUMN cloudinary_id TEXT;
-            EXCEPTION
-                WHEN duplicate_column THEN NULL;
-            END $$;
-        """)
-        cursor.execute("""
-            DO $$
-            BEGIN
-                ALTER TABLE wines ADD COLUMN price DECIMAL(10,2);
-            EXCEPTION
-                WHEN duplicate_column THEN NULL;
-            END $$;
-        """)
-        cursor.execute("""
-            DO $$
-            BEGIN
-                ALTER TABLE wines ADD COLUMN price_currency TEXT DEFAULT 'USD';
-            EXCEPTION
-                WHEN duplicate_column THEN NULL;
-            END $$;
-        """)
-    else:
-        cursor.execute("""
-            CREATE TABLE IF NOT EXISTS wines (
-                id INTEGER PRIMARY KEY AUTOINCREMENT,
-                name TEXT NOT NULL,
-                producer TEXT,
-                vintage INTEGER,
-                country TEXT,
-                region TEXT,
-                appellation TEXT,
-                style TEXT,
-                grape_varieties TEXT,
-                alcohol_percentage REAL,
-                quantity INTEGER DEFAULT 1,
-                drinking_window_start INTEGER,
-                drinking_window_end INTEGER,
-                score INTEGER,
-                description TEXT,
-                tasting_notes TEXT,
-                image_path TEXT,
-                cloudinary_id TEXT,
-                price REAL,
-                price_currency TEXT DEFAULT 'USD',
-                created_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP,
-                updated_at TIMESTAMP DEFAULT CURRENT_TIMESTAMP
-            )
-        """)
+    try:
+        cursor = get_cursor(conn)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
+        if USE_POSTGRES:
+            cursor.execute(POSTGRES_SCHEMA)
+        else:
+            cursor.execute("SELECT 1 FROM sqlite_master WHERE type = 'table' AND name = 'wines_fts'")
+            fts_exists = cursor.fetchone() is not None
+            cursor.executescript(SQLITE_SCHEMA)
+            if not fts_exists:
+                # Index wines that were added before the FTS table existed
+                cursor.execute("INSERT INTO wines_fts(wines_fts) VALUES ('rebuild')")
+
+        conn.commit()
+        cursor.close()
+    finally:
+        release_connection(conn)
 
 
 def row_to_dict(row):
@@ -143,124 +403,133 @@ def row_to_dict(row):
     else:
         d = dict(row)
 
-    # Parse JSON fields
-    if d.get("grape_varieties"):
+    # Parse JSON fields (PostgreSQL JSONB columns arrive already decoded)
+    if not d.get("grape_varieties"):
+        d["grape_varieties"] = []
+    elif isinstance(d["grape_varieties"], str):
         try:
-            d["grape_varieties"] = json.loads(d["grape_varieties"])
+            d["grape_varieties"] = json_loads(d["grape_varieties"])
         except (json.JSONDecodeError, TypeError):
             d["grape_varieties"] = []
-    else:
-        d["grape_varieties"] = []
 
-    if d.get("tasting_notes"):
+    if not d.get("tasting_notes"):
+        d["tasting_notes"] = {}
+    elif isinstance(d["tasting_notes"], str):
         try:
-            d["tasting_notes"] = json.loads(d["tasting_notes"])
+            d["tasting_notes"] = json_loads(d["tasting_notes"])
         except (json.JSONDecodeError, TypeError):
             d["tasting_notes"] = {}
-    else:
-        d["tasting_notes"] = {}
 
     return d
 
 
-def create_wine(data):
-    """Create a new wine entry."""
-    conn = get_connection()
-    cursor = get_cursor(conn)
+def fts_match_query(search):
+    """Build an FTS5 prefix query matching every word of the search text."""
+    terms = [term.replace('"', '""') for term in search.split()]
+    return " ".join(f'"{term}"*' for term in terms)
+
+
+def encode_json(value):
+    """Encode a JSON field for storage: JSONB on PostgreSQL, TEXT on SQLite."""
+    if USE_POSTGRES:
+        return Json(value)
+    return json_dumps(value)
+
+
+def wine_insert_params(data):
+    """Build the INSERT parameter tuple for a wine, serializing JSON fields."""
+    return (
+        data.get("name"),
+        data.get("producer"),
+        data.get("vintage"),
+        data.get("country"),
+        data.get("region"),
+        data.get("appellation"),
+        data.get("style"),
+        encode_json(data.get("grape_varieties", [])),
+        data.get("alcohol_percentage"),
+        data.get("quantity", 1),
+        data.get("drinking_window_start"),
+        data.get("drinking_window_end"),
+        data.get("score"),
+        data.get("description"),
+        encode_json(data.get("tasting_notes", {})),
+        data.get("image_path"),
+        data.get("cloudinary_id"),
+        data.get("price"),
+        data.get("price_currency", "USD")
+    )
+
+
+def insert_wine_query(values=None):
+    """
+    Get the INSERT statement matching wine_insert_params().
+    Pass values to replace the VALUES row (e.g. "%s" for execute_values).
+    """
     p = get_placeholder()
+    if values is None:
+        values = "(" + ", ".join([p] * len(INSERT_FIELDS)) + ")"
+    return f"INSERT INTO wines ({', '.join(INSERT_FIELDS)}) VALUES {values}"
 
-    # Serialize JSON fields
-    grape_varieties = json.dumps(data.get("grape_varieties", []))
-    tasting_notes = json.dumps(data.get("tasting_notes", {}))
+
+def create_wine(data, cursor=None):
+    """Create a new wine entry, inside the caller's transaction() if a cursor is given."""
+    if cursor is None:
+        with transaction() as cursor:
+            return create_wine(data, cursor)
 
     if USE_POSTGRES:
-        cursor.execute(f"""
-            INSERT INTO wines (
-                name, producer, vintage, country, region, appellation,
-                style, grape_varieties, alcohol_percentage, quantity,
-                drinking_window_start, drinking_window_end, score,
-                description, tasting_notes, image_path, cloudinary_id,
-                price, price_currency
-            ) VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})
-            RETURNING id
-        """, (
-            data.get("name"),
-            data.get("producer"),
-            data.get("vintage"),
-            data.get("country"),
-            data.get("region"),
-            data.get("appellation"),
-            data.get("style"),
-            grape_varieties,
-            data.get("alcohol_percentage"),
-            data.get("quantity", 1),
-            data.get("drinking_window_start"),
-            data.get("drinking_window_end"),
-            data.get("score"),
-            data.get("description"),
-            tasting_notes,
-            data.get("image_path"),
-            data.get("cloudinary_id"),
-            data.get("price"),
-            data.get("price_currency", "USD")
-        ))
-        wine_id = cursor.fetchone()["id"]
-    else:
-        cursor.execute(f"""
-            INSERT INTO wines (
-                name, producer, vintage, country, region, appellation,
-                style, grape_varieties, alcohol_percentage, quantity,
-                drinking_window_start, drinking_window_end, score,
-                description, tasting_notes, image_path, cloudinary_id,
-                price, price_currency
-            ) VALUES ({p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p}, {p})
-        """, (
-            data.get("name"),
-            data.get("producer"),
-            data.get("vintage"),
-            data.get("country"),
-            data.get("region"),
-            data.get("appellation"),
-            data.get("style"),
-            grape_varieties,
-            data.get("alcohol_percentage"),
-            data.get("quantity", 1),
-            data.get("drinking_window_start"),
-            data.get("drinking_window_end"),
-            data.get("score"),
-            data.get("description"),
-            tasting_notes,
-            data.get("image_path"),
-            data.get("cloudinary_id"),
-            data.get("price"),
-            data.get("price_currency", "USD")
-        ))
-        wine_id = cursor.lastrowid
-
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return wine_id
+        cursor.execute(insert_wine_query() + " RETURNING id", wine_insert_params(data))
+        return cursor.fetchone()["id"]
+    cursor.execute(insert_wine_query(), wine_insert_params(data))
+    return cursor.lastrowid
+
+
+def create_wines(data_list):
+    """
+    Create several wine entries in a single transaction.
+    Returns the new wine IDs in the same order as data_list.
+    """
+    if not data_list:
+        return []
+
+    with transaction() as cursor:
+        params = [wine_insert_params(data) for data in data_list]
+
+        if USE_POSTGRES:
+            # One multi-row INSERT per page instead of a statement per wine
+            rows = execute_values(
+                cursor, insert_wine_query("%s") + " RETURNING id", params,
+                page_size=BULK_INSERT_PAGE_SIZE, fetch=True
+            )
+            wine_ids = [row["id"] for row in rows]
+        else:
+            cursor.executemany(insert_wine_query(), params)
+            # The write lock is held until commit, so the new IDs are contiguous
+            cursor.execute("SELECT last_insert_rowid()")
+            last_id = cursor.fetchone()[0]
+            wine_ids = list(range(last_id - len(params) + 1, last_id + 1))
+    return wine_ids
 
 
 def get_wine(wine_id):
     """Get a single wine by ID."""
     conn = get_connection()
-    cursor = get_cursor(conn)
-    p = get_placeholder()
+    try:
+        cursor = get_cursor(conn)
+        p = get_placeholder()
 
-    cursor.execute(f"SELECT * FROM wines WHERE id = {p}", (wine_id,))
-    row = cursor.fetchone()
+        execute_prepared(cursor, "get_wine", f"SELECT * FROM wines WHERE id = {p}", (wine_id,))
+        row = cursor.fetchone()
 
-    cursor.close()
-    conn.close()
+        cursor.close()
+    finally:
+        release_connection(conn)
     return row_to_dict(row)
 
 
-def get_all_wines(filters=None):
-    """Get all wines with optional filtering."""
-    conn = get_connection()
-    cursor = get_cursor(conn)
+def build_wines_query(filters=None, ordered=True):
+    """Build the filtered, sorted wines SELECT. Returns (query, params)."""
     p = get_placeholder()
 
     query = "SELECT * FROM wines WHERE 1=1"
@@ -283,265 +552,357 @@ def get_all_wines(filters=None):
             query += f" AND vintage <= {p}"
             params.append(filters["vintage_max"])
         if filters.get("drinking_now"):
-            current_year = datetime.now().year
+            year = current_year()
             query += f" AND drinking_window_start <= {p} AND drinking_window_end >= {p}"
-            params.extend([current_year, current_year])
+            params.extend([year, year])
         if filters.get("search"):
-            search_term = f"%{filters['search']}%"
             if USE_POSTGRES:
-                query += f" AND (name ILIKE {p} OR producer ILIKE {p} OR grape_varieties ILIKE {p})"
+                search_term = f"%{filters['search']}%"
+                query += f" AND (name ILIKE {p} OR producer ILIKE {p} OR grape_varieties::text ILIKE {p})"
+                params.extend([search_term, search_term, search_term])
             else:
-                query += f" AND (name LIKE {p} OR producer LIKE {p} OR grape_varieties LIKE {p})"
-            params.extend([search_term, search_term, search_term])
+                match_query = fts_match_query(filters["search"])
+                if match_query:
+                    query += f" AND id IN (SELECT rowid FROM wines_fts WHERE wines_fts MATCH {p})"
+                    params.append(match_query)
+
+    if ordered:
+        query += f" {wines_order_by(filters)}"
 
-    # Sorting
+    return query, params
+
+
+def wines_order_by(filters=None):
+    """Build the ORDER BY clause for the sort requested in filters."""
     sort_by = filters.get("sort_by", "name") if filters else "name"
     sort_order = filters.get("sort_order", "asc") if filters else "asc"
-    valid_sort_fields = ["name", "vintage", "score", "quantity", "drinking_window_start", "created_at"]
-    if sort_by not in valid_sort_fields:
+    if sort_by not in VALID_SORT_FIELDS:
         sort_by = "name"
     sort_order = "DESC" if sort_order.lower() == "desc" else "ASC"
-    query += f" ORDER BY {sort_by} {sort_order}"
+    return f"ORDER BY {sort_by} {sort_order}"
+
+
+def iter_wines(filters=None):
+    """
+    Yield wines one at a time with optional filtering.
+    The connection is held until the generator is exhausted or closed.
+    """
+    conn = get_connection()
+    try:
+        cursor = get_cursor(conn, name="iter_wines")
 
-    cursor.execute(query, params)
-    rows = cursor.fetchall()
+        query, params = build_wines_query(filters)
+        cursor.execute(query, params)
+        for row in cursor:
+            yield row_to_dict(row)
 
-    cursor.close()
-    conn.close()
-    return [row_to_dict(row) for row in rows]
+        cursor.close()
+    finally:
+        release_connection(conn)
 
 
-def update_wine(wine_id, data):
-    """Update a wine entry."""
+def get_all_wines(filters=None):
+    """Get all wines with optional filtering."""
+    return list(iter_wines(filters))
+
+
+def get_all_wines_json(filters=None):
+    """
+    Get all wines with optional filtering as a JSON array string.
+    The database assembles the JSON, so rows never become Python dicts.
+    """
     conn = get_connection()
-    cursor = get_cursor(conn)
-    p = get_placeholder()
+    try:
+        cursor = get_cursor(conn)
 
-    # Build dynamic update query
-    fields = []
-    params = []
+        if USE_POSTGRES:
+            json_value = "COALESCE(NULLIF({column}, 'null'::jsonb), '{default}'::jsonb)"
+            # Encode these as jsonify does for /api/wines/<id>: HTTP dates and
+            # DECIMAL as a string ("12.50"), so both endpoints agree
+            column_values = {
+                "created_at": """to_char(created_at, 'Dy, DD Mon YYYY HH24:MI:SS "GMT"')""",
+                "updated_at": """to_char(updated_at, 'Dy, DD Mon YYYY HH24:MI:SS "GMT"')""",
+                "price": "price::text",
+            }
+        else:
+            json_value = "CASE WHEN json_valid({column}) THEN json({column}) ELSE json('{default}') END"
+            column_values = {}
+        for column, default in JSON_COLUMNS.items():
+            column_values[column] = json_value.format(column=column, default=default)
+        fields = ", ".join(
+            f"'{column}', {column_values.get(column, column)}" for column in WINE_COLUMNS
+        )
 
-    updatable_fields = [
-        "name", "producer", "vintage", "country", "region", "appellation",
-        "style", "alcohol_percentage", "quantity", "drinking_window_start",
-        "drinking_window_end", "score", "description", "image_path", "cloudinary_id",
-        "price", "price_currency"
-    ]
+        if USE_POSTGRES:
+            # Row order in the FROM subquery isn't guaranteed to survive json_agg
+            query, params = build_wines_query(filters, ordered=False)
+            cursor.execute(f"""
+                SELECT COALESCE(
+                    json_agg(json_build_object({fields}) {wines_order_by(filters)}), '[]'::json
+                )::text AS wines
+                FROM ({query}) AS filtered
+            """, params)
+        else:
+            query, params = build_wines_query(filters)
+            cursor.execute(f"""
+                SELECT json_group_array(json_object({fields})) AS wines
+                FROM ({query})
+            """, params)
+        wines_json = cursor.fetchone()["wines"]
+
+        cursor.close()
+    finally:
+        release_connection(conn)
+    return wines_json
 
-    for field in updatable_fields:
-        if field in data:
-            fields.append(f"{field} = {p}")
-            params.append(data[field])
 
-    # Handle JSON fields specially
-    if "grape_varieties" in data:
-        fields.append(f"grape_varieties = {p}")
-        params.append(json.dumps(data["grape_varieties"]))
+@functools.lru_cache(maxsize=512)
+def update_wine_query(fields):
+    """
+    Build the UPDATE statement for a tuple of fields, cached per field set.
+
+    Returns (name, query); the name is derived from the field set so each
+    update shape gets its own prepared statement.
+    """
+    p = get_placeholder()
+    assignments = [f"{field} = {p}" for field in fields]
+    assignments.append("updated_at = CURRENT_TIMESTAMP")
+    mask = sum(1 << UPDATABLE_FIELDS.index(field) for field in fields)
+    return f"update_wine_{mask:x}", f"UPDATE wines SET {', '.join(assignments)} WHERE id = {p}"
 
-    if "tasting_notes" in data:
-        fields.append(f"tasting_notes = {p}")
-        params.append(json.dumps(data["tasting_notes"]))
 
+def update_wine(wine_id, data, cursor=None):
+    """Update a wine entry, inside the caller's transaction() if a cursor is given."""
+    fields = tuple(field for field in UPDATABLE_FIELDS if field in data)
     if not fields:
-        cursor.close()
-        conn.close()
         return False
 
-    fields.append("updated_at = CURRENT_TIMESTAMP")
+    if cursor is None:
+        with transaction() as cursor:
+            return update_wine(wine_id, data, cursor)
+
+    # JSON fields are stored serialized
+    params = [encode_json(data[field]) if field in JSON_COLUMNS else data[field] for field in fields]
     params.append(wine_id)
 
-    query = f"UPDATE wines SET {', '.join(fields)} WHERE id = {p}"
-    cursor.execute(query, params)
+    execute_prepared(cursor, *update_wine_query(fields), params)
+    return cursor.rowcount > 0
 
-    success = cursor.rowcount > 0
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return success
 
+def delete_wine(wine_id, cursor=None):
+    """Delete a wine entry, inside the caller's transaction() if a cursor is given."""
+    if cursor is None:
+        with transaction() as cursor:
+            return delete_wine(wine_id, cursor)
 
-def delete_wine(wine_id):
-    """Delete a wine entry."""
-    conn = get_connection()
-    cursor = get_cursor(conn)
     p = get_placeholder()
-
     cursor.execute(f"DELETE FROM wines WHERE id = {p}", (wine_id,))
-    success = cursor.rowcount > 0
+    return cursor.rowcount > 0
+
+
+def current_year():
+    """Get the current local year, recomputed only once the year rolls over."""
+    global _year_cache
+    year, next_year_at = _year_cache
+    if time.time() >= next_year_at:
+        year = datetime.now().year
+        # Naive datetimes are local, so this is local midnight on 1 January
+        next_year_at = datetime(year + 1, 1, 1).timestamp()
+        _year_cache = (year, next_year_at)
+    return year
 
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return success
+
+def _bump_data_version():
+    """Invalidate cached query results after a write."""
+    global _data_version
+    _data_version += 1
 
 
 def get_stats():
-    """Get collection statistics."""
+    """Get collection statistics, cached until the next write or STATS_CACHE_TTL."""
+    return _cached_stats(_data_version, int(time.monotonic() // STATS_CACHE_TTL))
+
+
+@functools.lru_cache(maxsize=1)
+def _cached_stats(data_version, ttl_bucket):
+    """Compute collection statistics; arguments only key the cache."""
     conn = get_connection()
-    cursor = get_cursor(conn)
-    p = get_placeholder()
-    current_year = datetime.now().year
-
-    stats = {}
-
-    # Total bottles
-    cursor.execute("SELECT COALESCE(SUM(quantity), 0) as total FROM wines")
-    row = cursor.fetchone()
-    stats["total_bottles"] = row["total"] if isinstance(row, dict) else row[0]
-
-    # Total unique wines
-    cursor.execute("SELECT COUNT(*) as count FROM wines")
-    row = cursor.fetchone()
-    stats["total_wines"] = row["count"] if isinstance(row, dict) else row[0]
-
-    # By country
-    cursor.execute("""
-        SELECT country, SUM(quantity) as count
-        FROM wines
-        WHERE country IS NOT NULL
-        GROUP BY country
-        ORDER BY count DESC
-    """)
-    stats["by_country"] = [dict(row) if isinstance(row, dict) else {"country": row[0], "count": row[1]} for row in cursor.fetchall()]
-
-    # By style
-    cursor.execute("""
-        SELECT style, SUM(quantity) as count
-        FROM wines
-        WHERE style IS NOT NULL
-        GROUP BY style
-        ORDER BY count DESC
-    """)
-    stats["by_style"] = [dict(row) if isinstance(row, dict) else {"style": row[0], "count": row[1]} for row in cursor.fetchall()]
-
-    # Ready to drink
-    cursor.execute(f"""
-        SELECT COUNT(*) as count
-        FROM wines
-        WHERE drinking_window_start <= {p} AND drinking_window_end >= {p}
-    """, (current_year, current_year))
-    row = cursor.fetchone()
-    stats["ready_to_drink"] = row["count"] if isinstance(row, dict) else row[0]
-
-    # Needs cellaring
-    cursor.execute(f"""
-        SELECT COUNT(*) as count
-        FROM wines
-        WHERE drinking_window_start > {p}
-    """, (current_year,))
-    row = cursor.fetchone()
-    stats["needs_cellaring"] = row["count"] if isinstance(row, dict) else row[0]
-
-    cursor.close()
-    conn.close()
+    try:
+        cursor = get_cursor(conn)
+        p = get_placeholder()
+        year = current_year()
+
+        # One round trip: the totals CTE scans the table once, the breakdowns
+        # are grouped alongside it, and every value comes back as a
+        # (kind, label, count) row
+        execute_prepared(cursor, "collection_stats", f"""
+            WITH totals AS (
+                SELECT
+                    COALESCE(SUM(quantity), 0) as total_bottles,
+                    COUNT(*) as total_wines,
+                    COALESCE(SUM(CASE WHEN drinking_window_start <= {p} AND drinking_window_end >= {p}
+                                 THEN 1 ELSE 0 END), 0) as ready_to_drink,
+                    COALESCE(SUM(CASE WHEN drinking_window_start > {p}
+                                 THEN 1 ELSE 0 END), 0) as needs_cellaring
+                FROM wines
+            )
+            SELECT 'total_bottles' as kind, NULL as label, total_bottles as count FROM totals
+            UNION ALL SELECT 'total_wines', NULL, total_wines FROM totals
+            UNION ALL SELECT 'ready_to_drink', NULL, ready_to_drink FROM totals
+            UNION ALL SELECT 'needs_cellaring', NULL, needs_cellaring FROM totals
+            UNION ALL
+            SELECT 'country', country, SUM(quantity)
+            FROM wines
+            WHERE country IS NOT NULL
+            GROUP BY country
+            UNION ALL
+            SELECT 'style', style, SUM(quantity)
+            FROM wines
+            WHERE style IS NOT NULL
+            GROUP BY style
+            ORDER BY count DESC
+        """, (year, year, year))
+
+        stats = {"by_country": [], "by_style": []}
+        for row in cursor.fetchall():
+            if row["kind"] in ("country", "style"):
+                stats[f"by_{row['kind']}"].append({row["kind"]: row["label"], "count": row["count"]})
+            else:
+                stats[row["kind"]] = row["count"]
+
+        cursor.close()
+    finally:
+        release_connection(conn)
     return stats
 
 
+def ci_equals(column):
+    """SQL condition comparing a column to a placeholder, ignoring case."""
+    p = get_placeholder()
+    if USE_POSTGRES:
+        return f"LOWER({column}) = LOWER({p})"
+    return f"{column} = {p} COLLATE NOCASE"
+
+
 def find_matching_wine(name, producer=None, vintage=None):
     """
     Find a wine that matches the given criteria.
     Returns the wine if found, None otherwise.
     """
-    conn = get_connection()
-    cursor = get_cursor(conn)
-    p = get_placeholder()
+    row = _find_matching_row("*", name, producer, vintage)
+    if row:
+        return row_to_dict(row)
+    return None
 
-    # Try exact match first
-    if producer and vintage:
+
+def find_matching_wine_id(name, producer=None, vintage=None):
+    """
+    Find the ID of the wine find_matching_wine() would return, or None.
+    Skips fetching and decoding the full row.
+    """
+    row = _find_matching_row("id", name, producer, vintage)
+    if row:
+        return row["id"]
+    return None
+
+
+def _find_matching_row(columns, name, producer, vintage):
+    """
+    Select the given columns of the best matching wine.
+
+    Exact names are tried first: name + producer + vintage, then
+    name + vintage, then name + producer (newest first within a tier).
+    Only if none match are names containing the search term considered,
+    preferring the same vintage, then newest. Both steps run in one query.
+    """
+    conn = get_connection()
+    try:
+        cursor = get_cursor(conn)
+        p = get_placeholder()
+
+        # Empty values never match, as before
+        producer = producer or None
+        vintage = vintage or None
+
+        # Each tier is an equality probe of idx_wines_match(_nocase)
+        tiers = (
+            (f"{ci_equals('name')} AND {ci_equals('producer')} AND vintage = {p}", (name, producer, vintage)),
+            (f"{ci_equals('name')} AND vintage = {p}", (name, vintage)),
+            (f"{ci_equals('name')} AND {ci_equals('producer')}", (name, producer)),
+        )
+        exact_matches = " UNION ALL ".join(
+            f"SELECT * FROM (SELECT id, {rank} AS tier FROM wines WHERE {condition}"
+            f" ORDER BY created_at DESC LIMIT 1) AS tier{rank}"
+            for rank, (condition, _) in enumerate(tiers)
+        )
         if USE_POSTGRES:
-            cursor.execute(f"""
-                SELECT * FROM wines
-                WHERE LOWER(name) = LOWER({p})
-                AND LOWER(producer) = LOWER({p})
-                AND vintage = {p}
-            """, (name, producer, vintage))
+            name_like = f"name ILIKE {p}"
         else:
-            cursor.execute(f"""
-                SELECT * FROM wines
-                WHERE LOWER(name) = LOWER({p})
-                AND LOWER(producer) = LOWER({p})
-                AND vintage = {p}
-            """, (name, producer, vintage))
-        row = cursor.fetchone()
-        if row:
-            cursor.close()
-            conn.close()
-            return row_to_dict(row)
-
-    # Try name + vintage
-    if vintage:
-        cursor.execute(f"""
-            SELECT * FROM wines
-            WHERE LOWER(name) = LOWER({p})
-            AND vintage = {p}
-        """, (name, vintage))
-        row = cursor.fetchone()
-        if row:
-            cursor.close()
-            conn.close()
-            return row_to_dict(row)
+            # SQLite's LIKE is already case-insensitive
+            name_like = f"name LIKE {p}"
 
-    # Try name + producer
-    if producer:
+        # COALESCE only evaluates the containment scan when no exact tier matches
         cursor.execute(f"""
-            SELECT * FROM wines
-            WHERE LOWER(name) = LOWER({p})
-            AND LOWER(producer) = LOWER({p})
-        """, (name, producer))
+            SELECT {columns} FROM wines
+            WHERE id = COALESCE(
+                (SELECT id FROM ({exact_matches}) AS exact_matches ORDER BY tier LIMIT 1),
+                (SELECT id FROM wines
+                 WHERE {name_like}
+                 ORDER BY CASE WHEN vintage = {p} THEN 0 ELSE 1 END, created_at DESC
+                 LIMIT 1)
+            )
+        """, [param for _, params in tiers for param in params] + [f"%{name}%", vintage])
         row = cursor.fetchone()
-        if row:
-            cursor.close()
-            conn.close()
-            return row_to_dict(row)
 
-    # Try fuzzy match on name containing the search term
-    search_pattern = f"%{name}%"
-    if USE_POSTGRES:
-        cursor.execute(f"""
-            SELECT * FROM wines
-            WHERE LOWER(name) LIKE LOWER({p})
-            ORDER BY
-                CASE WHEN vintage = {p} THEN 0 ELSE 1 END,
-                created_at DESC
-            LIMIT 1
-        """, (search_pattern, vintage or 0))
-    else:
-        cursor.execute(f"""
-            SELECT * FROM wines
-            WHERE LOWER(name) LIKE LOWER({p})
-            ORDER BY
-                CASE WHEN vintage = {p} THEN 0 ELSE 1 END,
-                created_at DESC
-            LIMIT 1
-        """, (search_pattern, vintage or 0))
-    row = cursor.fetchone()
-
-    cursor.close()
-    conn.close()
+        cursor.close()
+    finally:
+        release_connection(conn)
+    return row
 
-    if row:
-        return row_to_dict(row)
-    return None
 
+def increment_wine_quantity(wine_id, amount=1, cursor=None):
+    """
+    Increment the quantity of a wine by the given amount,
+    inside the caller's transaction() if a cursor is given.
+    """
+    if cursor is None:
+        with transaction() as cursor:
+            return increment_wine_quantity(wine_id, amount, cursor)
 
-def increment_wine_quantity(wine_id, amount=1):
-    """Increment the quantity of a wine by the given amount."""
-    conn = get_connection()
-    cursor = get_cursor(conn)
     p = get_placeholder()
-
-    cursor.execute(f"""
+    execute_prepared(cursor, "increment_wine_quantity", f"""
         UPDATE wines
         SET quantity = quantity + {p}, updated_at = CURRENT_TIMESTAMP
         WHERE id = {p}
     """, (amount, wine_id))
-    success = cursor.rowcount > 0
+    return cursor.rowcount > 0
+
+
+def drink_bottle(wine_id, cursor=None):
+    """
+    Take one bottle of a wine, inside the caller's transaction() if a cursor is given.
+    Returns False if the wine doesn't exist or has no bottles left.
+    """
+    if cursor is None:
+        with transaction() as cursor:
+            return drink_bottle(wine_id, cursor)
 
-    conn.commit()
-    cursor.close()
-    conn.close()
-    return success
+    p = get_placeholder()
+    # Checking quantity in the UPDATE keeps concurrent drinks from going negative
+    execute_prepared(cursor, "drink_bottle", f"""
+        UPDATE wines
+        SET quantity = quantity - 1, updated_at = CURRENT_TIMESTAMP
+        WHERE id = {p} AND quantity > 0
+    """, (wine_id,))
+    return cursor.rowcount > 0
 
 
-# Initialize database on module import
-init_db()
+if __name__ == "__main__":
+    import sys
+
+    if sys.argv[1:] == ["init"]:
+        init_db()
+        print("Database initialized")
+    else:
+        print("Usage: python -m database init")
+        sys.exit(1)
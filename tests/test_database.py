@@ -0,0 +1,97 @@
+"""Tests for the SQLite path of the database helpers."""
+
+import json
+import tempfile
+import unittest
+from pathlib import Path
+from unittest import mock
+
+import database
+
+
+@unittest.skipIf(database.USE_POSTGRES, "runs against a temporary SQLite database")
+class SQLiteTestCase(unittest.TestCase):
+    def setUp(self):
+        tmp = tempfile.TemporaryDirectory()
+        self.addCleanup(tmp.cleanup)
+        patcher = mock.patch.object(database, "SQLITE_PATH", Path(tmp.name) / "wines.db")
+        patcher.start()
+        self.addCleanup(patcher.stop)
+        self.addCleanup(self.close_connection)
+        database.init_db()
+
+    def close_connection(self):
+        conn = getattr(database._local, "conn", None)
+        if conn is not None:
+            conn.close()
+            database._local.conn = None
+
+
+class TransactionTest(SQLiteTestCase):
+    def test_read_inside_transaction_keeps_batch(self):
+        with database.transaction() as cursor:
+            wine_id = database.create_wine({"name": "Barolo", "quantity": 2}, cursor)
+            self.assertEqual(database.get_wine(wine_id)["name"], "Barolo")
+            self.assertEqual(database.find_matching_wine_id("barolo"), wine_id)
+            database.increment_wine_quantity(wine_id, 1, cursor)
+
+        self.assertEqual(database.get_wine(wine_id)["quantity"], 3)
+
+    def test_nested_write_joins_outer_transaction(self):
+        with self.assertRaises(RuntimeError):
+            with database.transaction() as cursor:
+                database.create_wine({"name": "Rioja"}, cursor)
+                database.create_wine({"name": "Chianti"})
+                raise RuntimeError
+
+        self.assertEqual(database.get_all_wines(), [])
+
+    def test_stats_refresh_after_commit(self):
+        self.assertEqual(database.get_stats()["total_wines"], 0)
+        with database.transaction() as cursor:
+            database.create_wine({"name": "Rioja"}, cursor)
+            database.get_stats()
+
+        self.assertEqual(database.get_stats()["total_wines"], 1)
+
+
+
+class WinesJsonTest(SQLiteTestCase):
+    def setUp(self):
+        super().setUp()
+        database.create_wines([
+            {
+                "name": "Barolo", "producer": "Vietti", "vintage": 2016, "style": "Red",
+                "grape_varieties": ["Nebbiolo"], "tasting_notes": {"nose": "tar, roses"},
+                "price": 54.5, "drinking_window_start": 2020, "drinking_window_end": 2040,
+            },
+            {"name": "Chablis", "producer": "Fèvre", "vintage": 2021, "style": "White", "quantity": 3},
+            {"name": "Rioja", "style": "Red", "vintage": 2010, "score": 92},
+        ])
+        # Rows written outside create_wine() with empty, invalid or null JSON columns
+        with database.transaction() as cursor:
+            cursor.executemany(
+                "INSERT INTO wines (name, grape_varieties, tasting_notes) VALUES (?, ?, ?)",
+                [("Empty", "", ""), ("Invalid", "[oops", "{oops"), ("Missing", None, None), ("Null", "null", "null")],
+            )
+
+    def test_json_matches_row_dicts(self):
+        for filters in (
+            None,
+            {"search": "barolo"},
+            {"search": "nebbiolo"},
+            {"search": "no such wine"},
+            {"style": "Red", "sort_by": "vintage", "sort_order": "desc"},
+            {"sort_by": "score", "sort_order": "desc"},
+            {"sort_by": "price"},
+            {"drinking_now": True},
+        ):
+            with self.subTest(filters=filters):
+                self.assertEqual(
+                    json.loads(database.get_all_wines_json(filters)),
+                    database.get_all_wines(filters),
+                )
+
+
+if __name__ == "__main__":
+    unittest.main()
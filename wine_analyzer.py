@@ -1,9 +1,20 @@
 """Claude API integration for wine label analysis."""
 
 import os
-import base64
 import json
-from anthropic import Anthropic
+import mmap
+import re
+from datetime import datetime
+
+try:
+    import pybase64 as base64  # SIMD-accelerated, drop-in for the stdlib module
+except ImportError:
+    import base64
+
+try:
+    from orjson import loads as json_loads  # raises a json.JSONDecodeError subclass
+except ImportError:
+    from json import loads as json_loads
 
 _client = None
 
@@ -15,9 +26,42 @@ def get_client():
         api_key = os.environ.get("ANTHROPIC_API_KEY")
         if not api_key:
             raise ValueError("ANTHROPIC_API_KEY environment variable is not set")
+        # Deferred so importing this module doesn't pull in the SDK
+        from anthropic import Anthropic
         _client = Anthropic(api_key=api_key)
     return _client
 
+
+# Markdown code fence the model sometimes wraps its JSON in
+_FENCE_RE = re.compile(r"^```[^\n]*\n(.*?)(?:\n```|\Z)", re.S)
+
+MEDIA_TYPES = {
+    ".jpg": "image/jpeg",
+    ".jpeg": "image/jpeg",
+    ".png": "image/png",
+    ".gif": "image/gif",
+    ".webp": "image/webp"
+}
+
+
+def _parse_response(response_text):
+    """Parse a JSON reply from Claude, unwrapping a markdown code fence if present."""
+    match = _FENCE_RE.match(response_text)
+    if match:
+        response_text = match.group(1)
+    return json_loads(response_text)
+
+
+def _encode_image_file(image_path):
+    """Base64-encode an image file. Returns (base64_data, media_type)."""
+    with open(image_path, "rb") as f:
+        # Encode straight from a read-only mapping instead of a read() copy
+        with mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ) as mapped:
+            image_base64 = base64.standard_b64encode(mapped).decode("utf-8")
+    ext = os.path.splitext(image_path)[1].lower()
+    return image_base64, MEDIA_TYPES.get(ext, "image/jpeg")
+
+
 ANALYSIS_PROMPT = """Analyze this wine bottle label image and extract as much information as possible.
 
 Return a JSON object with the following fields (use null for any fields you cannot determine):
@@ -114,7 +158,7 @@ If you cannot identify the wine, return {"error": "Cannot identify wine"}
 Return ONLY the JSON object, no additional text."""
 
 
-def analyze_wine_image(image_path=None, image_base64=None, media_type="image/jpeg"):
+def analyze_wine_image(image_path=None, image_base64=None, media_type="image/jpeg", image_url=None):
     """
     Analyze a wine bottle image using Claude's vision capabilities.
 
@@ -122,34 +166,28 @@ def analyze_wine_image(image_path=None, image_base64=None, media_type="image/jpe
         image_path: Path to the image file (optional if image_base64 provided)
         image_base64: Base64-encoded image data (optional if image_path provided)
         media_type: MIME type of the image (default: image/jpeg)
+        image_url: Public URL Claude can fetch the image from (skips base64)
 
     Returns:
         dict: Extracted wine information or error
     """
-    if not image_path and not image_base64:
+    if not image_path and not image_base64 and not image_url:
         return {"error": "No image provided"}
 
     # Read and encode image if path provided
-    if image_path and not image_base64:
+    if image_path and not image_base64 and not image_url:
         try:
-            with open(image_path, "rb") as f:
-                image_base64 = base64.standard_b64encode(f.read()).decode("utf-8")
-
-            # Determine media type from extension
-            ext = os.path.splitext(image_path)[1].lower()
-            media_types = {
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".png": "image/png",
-                ".gif": "image/gif",
-                ".webp": "image/webp"
-            }
-            media_type = media_types.get(ext, "image/jpeg")
+            image_base64, media_type = _encode_image_file(image_path)
         except FileNotFoundError:
             return {"error": f"Image file not found: {image_path}"}
         except Exception as e:
             return {"error": f"Error reading image: {str(e)}"}
 
+    if image_url:
+        source = {"type": "url", "url": image_url}
+    else:
+        source = {"type": "base64", "media_type": media_type, "data": image_base64}
+
     try:
         client = get_client()
         response = client.messages.create(
@@ -161,11 +199,7 @@ def analyze_wine_image(image_path=None, image_base64=None, media_type="image/jpe
                     "content": [
                         {
                             "type": "image",
-                            "source": {
-                                "type": "base64",
-                                "media_type": media_type,
-                                "data": image_base64
-                            }
+                            "source": source
                         },
                         {
                             "type": "text",
@@ -178,25 +212,7 @@ def analyze_wine_image(image_path=None, image_base64=None, media_type="image/jpe
 
         # Parse the response
         response_text = response.content[0].text.strip()
-
-        # Try to extract JSON from the response
-        # Sometimes the model might wrap it in markdown code blocks
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            json_lines = []
-            in_json = False
-            for line in lines:
-                if line.startswith("```") and not in_json:
-                    in_json = True
-                    continue
-                elif line.startswith("```") and in_json:
-                    break
-                elif in_json:
-                    json_lines.append(line)
-            response_text = "\n".join(json_lines)
-
-        result = json.loads(response_text)
-        return result
+        return _parse_response(response_text)
 
     except json.JSONDecodeError as e:
         return {"error": f"Failed to parse AI response: {str(e)}", "raw_response": response_text}
@@ -240,21 +256,7 @@ def analyze_with_clarification(image_base64, media_type, style):
         )
 
         response_text = response.content[0].text.strip()
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            json_lines = []
-            in_json = False
-            for line in lines:
-                if line.startswith("```") and not in_json:
-                    in_json = True
-                    continue
-                elif line.startswith("```") and in_json:
-                    break
-                elif in_json:
-                    json_lines.append(line)
-            response_text = "\n".join(json_lines)
-
-        return json.loads(response_text)
+        return _parse_response(response_text)
 
     except json.JSONDecodeError as e:
         return {"error": f"Failed to parse AI response: {str(e)}"}
@@ -272,17 +274,7 @@ def identify_wine_image(image_path=None, image_base64=None, media_type="image/jp
 
     if image_path and not image_base64:
         try:
-            with open(image_path, "rb") as f:
-                image_base64 = base64.standard_b64encode(f.read()).decode("utf-8")
-            ext = os.path.splitext(image_path)[1].lower()
-            media_types = {
-                ".jpg": "image/jpeg",
-                ".jpeg": "image/jpeg",
-                ".png": "image/png",
-                ".gif": "image/gif",
-                ".webp": "image/webp"
-            }
-            media_type = media_types.get(ext, "image/jpeg")
+            image_base64, media_type = _encode_image_file(image_path)
         except FileNotFoundError:
             return {"error": f"Image file not found: {image_path}"}
         except Exception as e:
@@ -292,7 +284,7 @@ def identify_wine_image(image_path=None, image_base64=None, media_type="image/jp
         client = get_client()
         response = client.messages.create(
             model="claude-sonnet-4-20250514",
-            max_tokens=500,
+            max_tokens=200,
             messages=[
                 {
                     "role": "user",
@@ -315,21 +307,7 @@ def identify_wine_image(image_path=None, image_base64=None, media_type="image/jp
         )
 
         response_text = response.content[0].text.strip()
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            json_lines = []
-            in_json = False
-            for line in lines:
-                if line.startswith("```") and not in_json:
-                    in_json = True
-                    continue
-                elif line.startswith("```") and in_json:
-                    break
-                elif in_json:
-                    json_lines.append(line)
-            response_text = "\n".join(json_lines)
-
-        return json.loads(response_text)
+        return _parse_response(response_text)
 
     except json.JSONDecodeError as e:
         return {"error": f"Failed to parse AI response: {str(e)}"}
@@ -348,7 +326,7 @@ Suggest up to 3 wines from their collection that would pair well with this food.
 
 Consider:
 - Classic food and wine pairing principles (acidity, weight, flavors)
-- The wines that are ready to drink now (check drinking windows vs current year 2026)
+- The wines that are ready to drink now (check drinking windows vs current year {current_year})
 - If the food sounds casual (pizza, Tuesday dinner, takeout), prefer more affordable wines (use price field if available)
 - If it sounds special (anniversary, celebration, fancy dinner), premium/expensive wines are appropriate
 - Use the price field to help determine everyday vs special occasion wines
@@ -378,21 +356,20 @@ def get_wine_pairing(wines, food_description):
     Get wine pairing suggestions from the user's collection.
 
     Args:
-        wines: List of wine dictionaries from the database
+        wines: Iterable of wine dictionaries from the database (may be a generator)
         food_description: What the user is eating/cooking
 
     Returns:
         dict: Suggestions with wine IDs and explanations
     """
-    if not wines:
-        return {"suggestions": [], "tip": "Your collection is empty. Add some wines first!"}
-
     if not food_description:
         return {"error": "Please describe what you're eating"}
 
     # Format wines for the prompt (simplified to save tokens)
     wines_for_prompt = []
+    wine_count = 0
     for w in wines:
+        wine_count += 1
         wine_info = {
             "id": w["id"],
             "name": w["name"],
@@ -409,12 +386,16 @@ def get_wine_pairing(wines, food_description):
         if wine_info["quantity"] > 0:
             wines_for_prompt.append(wine_info)
 
+    if not wine_count:
+        return {"suggestions": [], "tip": "Your collection is empty. Add some wines first!"}
+
     if not wines_for_prompt:
         return {"suggestions": [], "tip": "No bottles available in your collection."}
 
     prompt = PAIRING_PROMPT.format(
         wines_json=json.dumps(wines_for_prompt, indent=2),
-        food_description=food_description
+        food_description=food_description,
+        current_year=datetime.now().year
     )
 
     try:
@@ -431,23 +412,7 @@ def get_wine_pairing(wines, food_description):
         )
 
         response_text = response.content[0].text.strip()
-
-        # Handle markdown code blocks
-        if response_text.startswith("```"):
-            lines = response_text.split("\n")
-            json_lines = []
-            in_json = False
-            for line in lines:
-                if line.startswith("```") and not in_json:
-                    in_json = True
-                    continue
-                elif line.startswith("```") and in_json:
-                    break
-                elif in_json:
-                    json_lines.append(line)
-            response_text = "\n".join(json_lines)
-
-        return json.loads(response_text)
+        return _parse_response(response_text)
 
     except json.JSONDecodeError as e:
         return {"error": f"Failed to parse response: {str(e)}"}
@@ -455,6 +420,18 @@ def get_wine_pairing(wines, food_description):
         return {"error": f"API error: {str(e)}"}
 
 
+VALID_STYLES = frozenset({"Red", "White", "Rosé", "Sparkling", "Dessert", "Fortified"})
+
+# (field, type, min, max) for numeric values returned by the model
+_NUMERIC_FIELDS = (
+    ("vintage", int, 1800, 2100),
+    ("drinking_window_start", int, 1900, 2200),
+    ("drinking_window_end", int, 1900, 2200),
+    ("score", int, 0, 100),
+    ("alcohol_percentage", float, 0, 100),
+)
+
+
 def validate_wine_data(data):
     """
     Validate and clean wine data from AI analysis.
@@ -480,66 +457,17 @@ def validate_wine_data(data):
         cleaned[field] = value if value else None
 
     # Style validation
-    valid_styles = ["Red", "White", "Rosé", "Sparkling", "Dessert", "Fortified"]
     style = data.get("style")
-    cleaned["style"] = style if style in valid_styles else None
+    cleaned["style"] = style if style in VALID_STYLES else None
 
-    # Integer fields
-    vintage = data.get("vintage")
-    if vintage is not None:
+    # Numeric fields, dropped when unparseable or out of range
+    for field, cast, low, high in _NUMERIC_FIELDS:
         try:
-            vintage = int(vintage)
-            if 1800 <= vintage <= 2100:
-                cleaned["vintage"] = vintage
-            else:
-                cleaned["vintage"] = None
+            value = cast(data.get(field))
         except (ValueError, TypeError):
-            cleaned["vintage"] = None
-    else:
-        cleaned["vintage"] = None
-
-    # Drinking window
-    for field in ["drinking_window_start", "drinking_window_end"]:
-        value = data.get(field)
-        if value is not None:
-            try:
-                value = int(value)
-                if 1900 <= value <= 2200:
-                    cleaned[field] = value
-                else:
-                    cleaned[field] = None
-            except (ValueError, TypeError):
-                cleaned[field] = None
-        else:
             cleaned[field] = None
-
-    # Score (0-100)
-    score = data.get("score")
-    if score is not None:
-        try:
-            score = int(score)
-            if 0 <= score <= 100:
-                cleaned["score"] = score
-            else:
-                cleaned["score"] = None
-        except (ValueError, TypeError):
-            cleaned["score"] = None
-    else:
-        cleaned["score"] = None
-
-    # Alcohol percentage
-    alcohol = data.get("alcohol_percentage")
-    if alcohol is not None:
-        try:
-            alcohol = float(alcohol)
-            if 0 <= alcohol <= 100:
-                cleaned["alcohol_percentage"] = alcohol
-            else:
-                cleaned["alcohol_percentage"] = None
-        except (ValueError, TypeError):
-            cleaned["alcohol_percentage"] = None
-    else:
-        cleaned["alcohol_percentage"] = None
+        else:
+            cleaned[field] = value if low <= value <= high else None
 
     # Grape varieties (array)
     grapes = data.get("grape_varieties")